@@ -1,10 +1,10 @@
 import os
 import subprocess
 import sys
-import glob
 import json
 import csv
 import time
+import uuid
 from datetime import datetime
 from typing import Dict, Any, List
 
@@ -15,6 +15,7 @@ BENCHMARK_DIR = "/usr/local/google/home/yangligt/workplaces/vllm/benchmarks"
 
 # --- Define the Master CSV file ---
 RESULTS_CSV_FILE = "benchmark_results.csv"
+RAW_RESULTS_DIR = "raw_results"
 GPU_COOLDOWN_SEC = 60
 
 # --- List of all benchmark configurations to run ---
@@ -66,12 +67,23 @@ for input_len in INPUT_LENS:
 
 
 
+def make_result_filename(config: Dict[str, Any]) -> str:
+    """
+    Builds a unique result file name in the style of vLLM's default naming,
+    e.g. vllm-infqps-concurrency64-Llama-3.3-70B-Instruct-FP8-20251021-203116-1a2b3c4d.json.
+    """
+    model_id = config["model"].split("/")[-1]
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return f"vllm-{config['req_rate']}qps-concurrency{config['max_curr']}-{model_id}-{timestamp}-{uuid.uuid4().hex[:8]}.json"
+
+
 def run_benchmark(config: Dict[str, Any]) -> Dict[str, Any]:
     """
     Runs a single benchmark using the provided config and returns the results.
     """
-    temp_result_file = "temp_benchmark_output.json"
-    
+    result_filename = make_result_filename(config)
+    result_file = os.path.join(RAW_RESULTS_DIR, result_filename)
+
     # Construct the command
     command = [
         sys.executable, f"{BENCHMARK_DIR}/benchmark_serving.py",
@@ -86,41 +98,29 @@ def run_benchmark(config: Dict[str, Any]) -> Dict[str, Any]:
         "--num-prompts", str(config["num_prompts"]),
         "--request-rate", str(config["req_rate"]),
         "--max-concurrency", str(config["max_curr"]),
-        "--save-result"  # The script generates its own output file
+        "--save-result",
+        "--result-dir", RAW_RESULTS_DIR,
+        "--result-filename", result_filename,
     ]
     
     print(f"\n--- Running benchmark for config: {config['max_curr']} max_curr, {config['input_len']} input_len ---")
     print(f"Executing: {' '.join(command)}")
     
     try:
-        # Run the benchmark command
-        # Find existing result files before the run to isolate the new one.
-        files_before = set(glob.glob("vllm-*.json"))
+        # Run the benchmark command, writing the result straight into the archive directory
         subprocess.run(command, check=True)
-        files_after = set(glob.glob("vllm-*.json"))
 
-        new_files = files_after - files_before
-        if not new_files:
-            print("Error: Benchmark ran, but no new result file (vllm-*.json) was found.")
+        if not os.path.exists(result_file):
+            print(f"Error: Benchmark ran, but the result file {result_file} was not found.")
             return None
-        if len(new_files) > 1:
-            print(f"Warning: Multiple new result files found. Using the first one: {list(new_files)[0]}")
 
-        result_file = new_files.pop()
         print(f"--- Found result file: {result_file} ---")
         
         # Load the results from the JSON file
         with open(result_file, 'r') as f:
             results = json.load(f)
-            
-        # --- Move the raw JSON result to the archive directory ---
-        raw_results_dir = "raw_results"
-        os.makedirs(raw_results_dir, exist_ok=True)
 
-        # Move the original file to the raw_results directory
-        archive_filepath = os.path.join(raw_results_dir, os.path.basename(result_file))
-        os.rename(result_file, archive_filepath)
-        print(f"--- Raw results saved to: {archive_filepath} ---")
+        print(f"--- Raw results saved to: {result_file} ---")
 
         return results
         
@@ -132,6 +132,9 @@ def main():
     """
     Main function to loop through configs and save results.
     """
+    # The benchmark writes its result files straight into this directory
+    os.makedirs(RAW_RESULTS_DIR, exist_ok=True)
+
     # Check if the CSV file needs a header.
     # This is true if the file doesn't exist or is empty.
     write_header = not os.path.exists(RESULTS_CSV_FILE) or os.path.getsize(RESULTS_CSV_FILE) == 0
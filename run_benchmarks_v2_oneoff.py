@@ -1,10 +1,11 @@
 import os
 import subprocess
 import sys
-import glob
 import json
 import csv
 import time
+import shlex
+import uuid
 from datetime import datetime
 from typing import Dict, Any, List
 
@@ -15,6 +16,7 @@ PORT = 80
 # --- Define the Master CSV file ---
 RESULTS_CSV_FILE = "benchmark_results_v2.csv"
 FAILED_RUNS_FILE = "failed_runs.json"
+RAW_RESULTS_DIR = "raw_results"
 MAX_RETRIES = 5
 GPU_COOLDOWN_SEC = 60
 
@@ -77,44 +79,57 @@ def log_failed_run(config: Dict[str, Any]):
         print(f"Error writing to {FAILED_RUNS_FILE}: {e}")
 
 
+def make_result_filename(config: Dict[str, Any]) -> str:
+    """
+    Builds a unique result file name in the style of vLLM's default naming,
+    e.g. vllm-infqps-concurrency64-Llama-3.3-70B-Instruct-FP8-20251021-203116-1a2b3c4d.json.
+    """
+    model_id = config["model"].split("/")[-1]
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return f"vllm-{config['req_rate']}qps-concurrency{config['max_curr']}-{model_id}-{timestamp}-{uuid.uuid4().hex[:8]}.json"
+
+
 def run_benchmark(config: Dict[str, Any]) -> Dict[str, Any]:
     """
     Runs a single benchmark using the provided config and returns the results.
     Retries on failure (completed != num_prompts).
     """
+    # The command is the same for every attempt; a failed attempt removes its result file,
+    # so retries can reuse the file name.
+    result_filename = make_result_filename(config)
+    result_file = os.path.join(RAW_RESULTS_DIR, result_filename)
+    command = [
+        "vllm", "bench", "serve",
+        "--base-url", f"http://{IP}:{PORT}",
+        "--backend", "vllm",
+        "--model", config["model"],
+        "--endpoint", "/v1/completions",
+        "--tokenizer", config["tokenizer"],
+        "--dataset-name", "random",
+        "--random-input-len", str(config["input_len"]),
+        "--random-output-len", str(config["output_len"]),
+        "--num-prompts", str(config["num_prompts"]),
+        "--request-rate", str(config["req_rate"]),
+        "--max-concurrency", str(config["max_curr"]),
+        "--percentile-metrics", "ttft,tpot,itl,e2el",
+        "--save-result",
+        "--result-dir", RAW_RESULTS_DIR,
+        "--result-filename", result_filename,
+    ]
+    command_str = shlex.join(command)
+
     for attempt in range(MAX_RETRIES):
         print(f"\n--- Running benchmark (Attempt {attempt + 1}/{MAX_RETRIES}) for config: "
               f"max_curr={config['max_curr']}, input_len={config['input_len']}, output_len={config['output_len']} ---")
-        
-        command = [
-            "vllm", "bench", "serve",
-            "--base-url", f"http://{IP}:{PORT}",
-            "--backend", "vllm",
-            "--model", config["model"],
-            "--endpoint", "/v1/completions",
-            "--tokenizer", config["tokenizer"],
-            "--dataset-name", "random",
-            "--random-input-len", str(config["input_len"]),
-            "--random-output-len", str(config["output_len"]),
-            "--num-prompts", str(config["num_prompts"]),
-            "--request-rate", str(config["req_rate"]),
-            "--max-concurrency", str(config["max_curr"]),
-            "--percentile-metrics", "ttft,tpot,itl,e2el",
-            "--save-result"
-        ]
-        print(f"Executing: {' '.join(command)}")
+        print(f"Executing: {command_str}")
 
         try:
-            files_before = set(glob.glob("vllm-*.json"))
             subprocess.run(command, check=True, capture_output=True, text=True)
-            files_after = set(glob.glob("vllm-*.json"))
 
-            new_files = files_after - files_before
-            if not new_files:
-                print("Error: Benchmark ran, but no new result file (vllm-*.json) was found.")
+            if not os.path.exists(result_file):
+                print(f"Error: Benchmark ran, but the result file {result_file} was not found.")
                 continue # Go to next retry attempt
 
-            result_file = new_files.pop()
             print(f"--- Found result file: {result_file} ---")
             
             with open(result_file, 'r') as f:
@@ -123,12 +138,7 @@ def run_benchmark(config: Dict[str, Any]) -> Dict[str, Any]:
             # --- Success Condition Check ---
             if results.get("completed") == config.get("num_prompts"):
                 print("--- Benchmark successful: completed requests match num_prompts. ---")
-                # Move successful result to archive
-                raw_results_dir = "raw_results"
-                os.makedirs(raw_results_dir, exist_ok=True)
-                archive_filepath = os.path.join(raw_results_dir, os.path.basename(result_file))
-                os.rename(result_file, archive_filepath)
-                print(f"--- Raw results saved to: {archive_filepath} ---")
+                print(f"--- Raw results saved to: {result_file} ---")
                 return results
             else:
                 completed = results.get("completed", "N/A")
@@ -147,7 +157,8 @@ def run_benchmark(config: Dict[str, Any]) -> Dict[str, Any]:
             time.sleep(GPU_COOLDOWN_SEC)
 
     # If all retries fail
-    print(f"--- Benchmark failed after {MAX_RETRIES} attempts. Logging to {FAILED_RUNS_FILE} ---")
+    print(f"--- Benchmark failed after {MAX_RETRIES} attempts: {command_str} ---")
+    print(f"--- Logging to {FAILED_RUNS_FILE} ---")
     log_failed_run(config)
     return None
 
@@ -155,6 +166,9 @@ def main():
     """
     Main function to loop through configs and save results.
     """
+    # The benchmark writes its result files straight into this directory
+    os.makedirs(RAW_RESULTS_DIR, exist_ok=True)
+
     # Check if the CSV file needs a header.
     # This is true if the file doesn't exist or is empty.
     write_header = not os.path.exists(RESULTS_CSV_FILE) or os.path.getsize(RESULTS_CSV_FILE) == 0
@@ -1,14 +1,85 @@
 import os
 import subprocess
 import sys
-import glob
 import json
 import csv
 import time
 import argparse
+import ast
+import codecs
+import itertools
+import re
+import shlex
+import threading
+import uuid
+import requests
 import yaml
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import Dict, Any, List
+from types import CodeType
+from typing import Callable, Dict, Any, List, Tuple
+
+# Use the libyaml C loader when PyYAML was built with it.
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+# Config columns that lead every CSV row, in this order.
+CSV_BASE_KEYS = [
+    "model", "tokenizer", "hardware", "notes", "pd_enabled",
+    "prefill_node", "prefill_dp", "prefill_tp",
+    "decode_node", "decode_dp", "decode_tp"
+]
+
+# Summary fields written by `vllm bench serve --save-result`, in the order it writes them.
+RESULT_FIELDS = [
+    "date", "endpoint_type", "backend", "label", "model_id", "tokenizer_id",
+    "num_prompts", "request_rate", "burstiness", "max_concurrency",
+    "duration", "completed", "total_input_tokens", "total_output_tokens",
+    "request_throughput", "request_goodput", "output_throughput", "total_token_throughput",
+    "max_output_tokens_per_s", "max_concurrent_requests",
+    "mean_ttft_ms", "median_ttft_ms", "std_ttft_ms", "p99_ttft_ms",
+    "mean_tpot_ms", "median_tpot_ms", "std_tpot_ms", "p99_tpot_ms",
+    "mean_itl_ms", "median_itl_ms", "std_itl_ms", "p99_itl_ms",
+    "mean_e2el_ms", "median_e2el_ms", "std_e2el_ms", "p99_e2el_ms",
+]
+
+def should_skip(config: Dict[str, Any], skip_if: List[CodeType]) -> bool:
+    """
+    Evaluates the compiled `skip_if` expressions from the parameter sweep against a config.
+    Config keys are available as variables, e.g. "max_curr * input_len < 8192".
+    An expression that can't be evaluated for a config's values (e.g. max_curr is None) doesn't skip it.
+    """
+    for expr in skip_if:
+        try:
+            if eval(expr, {"__builtins__": {}}, dict(config)):
+                return True
+        except TypeError:
+            continue
+    return False
+
+
+def compute_num_prompts(base_config: Dict[str, Any], req_rate: Any, max_curr: Any) -> int:
+    """Returns num_prompts from the base config if set, otherwise derives it from the load level."""
+    explicit_num_prompts = base_config.get("num_prompts")
+    if isinstance(explicit_num_prompts, (int, float)):
+        return int(explicit_num_prompts)
+
+    if max_curr is not None:
+        # Throughput test (req_rate is "inf", max_curr is a number)
+        calculated_num_prompts_base = 10 * max_curr
+    else:
+        # Latency test (req_rate is a number, max_curr is None)
+        try:
+            calculated_num_prompts_base = int(float(req_rate) * 60) # req_rate * 60 seconds
+        except ValueError:
+            # Not reachable through generate_benchmark_configs, whose pairing logic skips this state.
+            print(f"Warning: Unexpected state - req_rate '{req_rate}' is not a number while max_curr is None. Defaulting num_prompts.")
+            calculated_num_prompts_base = 512 # Fallback
+
+    return max(512, calculated_num_prompts_base)
+
 
 def generate_benchmark_configs(base_config: Dict[str, Any], sweep_params: Dict[str, Any]) -> List[Dict[str, Any]]:
     """Generates a list of benchmark configurations from sweep parameters."""
@@ -18,135 +89,343 @@ def generate_benchmark_configs(base_config: Dict[str, Any], sweep_params: Dict[s
     input_lens = sweep_params.get("input_lens", [])
     output_len_ratios = sweep_params.get("input_to_output_len_ratios", [])
     max_concurrency_values = sweep_params.get("max_concurrency_values", [])
-
-    for req_rate in req_rates:
-        for input_len in input_lens:
-            for ratio in output_len_ratios:
-                output_len = int(round(input_len / ratio))
-                if output_len > 1024:
-                    continue
-
-                for max_curr in max_concurrency_values:
-                    # Logic to pair req_rate and max_concurrency correctly:
-                    # - If req_rate is 'inf' (throughput), max_curr must be a number.
-                    # - If req_rate is a number (latency), max_curr should be None.
-                    if req_rate == "inf" and max_curr is None:
-                        continue
-                    if req_rate != "inf" and max_curr is not None:
-                        continue
-
-                    config = base_config.copy()
-
-                    # Check if num_prompts is explicitly provided in the base_config
-                    explicit_num_prompts = config.get("num_prompts")
-
-                    num_prompts_for_this_config = None
-                    if isinstance(explicit_num_prompts, (int, float)):
-                        num_prompts_for_this_config = int(explicit_num_prompts)
-
-                    if num_prompts_for_this_config is None:
-                        # Calculate num_prompts if not explicitly provided or not a valid number
-                        calculated_num_prompts_base = 0
-                        if max_curr is not None:
-                            # Throughput test (req_rate is "inf", max_curr is a number)
-                            calculated_num_prompts_base = 10 * max_curr
-                        else:
-                            # Latency test (req_rate is a number, max_curr is None)
-                            # Based on the pairing logic, req_rate must be a number here.
-                            try:
-                                req_rate_float = float(req_rate)
-                                calculated_num_prompts_base = int(req_rate_float * 60) # req_rate * 60 seconds
-                            except ValueError:
-                                # This case should ideally not be reached due to earlier pairing logic.
-                                # If it is, it means req_rate is not a number while max_curr is None,
-                                # which is an invalid state that should have been skipped.
-                                print(f"Warning: Unexpected state - req_rate '{req_rate}' is not a number while max_curr is None. Defaulting num_prompts.")
-                                calculated_num_prompts_base = 512 # Fallback
-
-                        num_prompts_for_this_config = max(512, calculated_num_prompts_base)
-
-                    config.update({
-                        "req_rate": req_rate,
-                        "input_len": input_len,
-                        "output_len": output_len, # This line was missing in the original selection, but is part of the config update.
-                        "num_prompts": num_prompts_for_this_config,
-                        "max_curr": max_curr,
-                    })
-                    configs.append(config)
+    skip_if_exprs = sweep_params.get("skip_if", [])
+    if isinstance(skip_if_exprs, str):
+        skip_if_exprs = [skip_if_exprs]
+
+    # Compile the expressions once and check the names they use against the config keys,
+    # so a typo is reported as a config error before anything runs.
+    config_keys = set(base_config) | {"req_rate", "input_len", "output_len", "num_prompts", "max_curr"}
+    skip_if = []
+    for expr in skip_if_exprs:
+        try:
+            tree = ast.parse(expr, "skip_if", "eval")
+            skip_if.append(compile(tree, "skip_if", "eval"))
+        except (SyntaxError, TypeError, ValueError) as e:
+            print(f"Error: Invalid skip_if expression {expr!r} in parameter_sweep: {e}")
+            sys.exit(1)
+        unknown_names = sorted({node.id for node in ast.walk(tree) if isinstance(node, ast.Name)} - config_keys)
+        if unknown_names:
+            print(f"Error: skip_if expression {expr!r} in parameter_sweep uses unknown names {unknown_names}; "
+                  f"available config keys: {sorted(config_keys)}")
+            sys.exit(1)
+
+    for req_rate, input_len, ratio, max_curr in itertools.product(req_rates, input_lens, output_len_ratios, max_concurrency_values):
+        output_len = int(round(input_len / ratio))
+        if output_len > 1024:
+            continue
+
+        # Logic to pair req_rate and max_concurrency correctly:
+        # - If req_rate is 'inf' (throughput), max_curr must be a number.
+        # - If req_rate is a number (latency), max_curr should be None.
+        if (req_rate == "inf") != (max_curr is not None):
+            continue
+
+        config = base_config | {
+            "req_rate": req_rate,
+            "input_len": input_len,
+            "output_len": output_len,
+            "num_prompts": compute_num_prompts(base_config, req_rate, max_curr),
+            "max_curr": max_curr,
+        }
+        if skip_if and should_skip(config, skip_if):
+            continue
+        configs.append(config)
     return configs
 
 
+def append_jsonl(path: str, record: Dict[str, Any]):
+    """
+    Appends a record as one line to a JSON Lines file.
+    The line is written with a single O_APPEND write, so concurrent sweeps can log safely.
+    """
+    line = (json.dumps(record) + "\n").encode()
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        print(f"Error writing to {path}: {e}")
+
+
+def load_jsonl(path: str) -> List[Dict[str, Any]]:
+    """Reads back the records written by `append_jsonl`."""
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
 def log_failed_run(config: Dict[str, Any], failed_runs_file: str):
-    """Appends a failed benchmark config to the specified JSON file."""
+    """Appends a failed benchmark config to the specified JSON Lines file."""
+    append_jsonl(failed_runs_file, config)
+
+
+def log_completed_run(config: Dict[str, Any], completed_runs_file: str, skipped: str = None):
+    """
+    Records a finished sweep point in the completed runs JSON Lines file, so a resumed sweep skips it.
+    `skipped` gives the reason for points that were deliberately not run (e.g. "saturated").
+    """
+    record = {k: config.get(k) for k in ("req_rate", "input_len", "output_len", "max_curr", "timestamp_ns")}
+    if skipped:
+        record["skipped"] = skipped
+    append_jsonl(completed_runs_file, record)
+
+
+def load_failed_runs(failed_runs_file: str) -> List[Dict[str, Any]]:
+    """Reads back the failed benchmark configs logged by `log_failed_run`."""
+    return load_jsonl(failed_runs_file)
+
+
+def resume_key(config: Dict[str, Any]) -> Tuple[Any, Any, Any, Any]:
+    """Identifies a sweep point for resuming: (input_len, output_len, max_curr, req_rate)."""
+    return (config["input_len"], config["output_len"], config["max_curr"], config["req_rate"])
+
+
+def get_servers(exp_setup: Dict[str, Any]) -> List[Tuple[str, int]]:
+    """
+    Returns the list of (ip, port) servers to spread the sweep across.
+    Uses `servers` from the experiment setup if present, otherwise the single `ip`/`port`.
+    """
+    servers = exp_setup.get("servers")
+    if servers:
+        return [(str(ip), int(port)) for ip, port in servers]
+    return [(exp_setup["ip"], exp_setup["port"])]
+
+
+def read_server_load(ip: str, port: int) -> Tuple[float, float]:
+    """
+    Reads the vLLM Prometheus `/metrics` endpoint and returns (running requests, KV cache usage).
+    Running requests are summed and cache usage is the max across engines.
+    """
+    response = requests.get(f"http://{ip}:{port}/metrics", timeout=2)
+    response.raise_for_status()
+
+    running, cache_usage = None, None
+    for line in response.text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        name = line.split("{", 1)[0].split(" ", 1)[0]
+        if name == "vllm:num_requests_running":
+            running = (running or 0.0) + float(line.rsplit(" ", 1)[1])
+        # Older vLLM versions call this gpu_cache_usage_perc.
+        elif name in ("vllm:kv_cache_usage_perc", "vllm:gpu_cache_usage_perc"):
+            cache_usage = max(cache_usage or 0.0, float(line.rsplit(" ", 1)[1]))
+
+    if running is None or cache_usage is None:
+        raise ValueError("vllm:num_requests_running / KV cache usage not found in /metrics")
+    return running, cache_usage
+
+
+def wait_for_server_idle(ip: str, port: int, max_wait: float, poll_interval: float = 1.0):
+    """
+    Waits until the server reports no running requests and a near-empty KV cache on two
+    consecutive polls, or until `max_wait` seconds have passed.
+    Falls back to sleeping out the rest of `max_wait` if the metrics can't be read.
+    """
+    start = time.time()
+    idle_polls = 0
+    while time.time() - start < max_wait:
+        try:
+            running, cache_usage = read_server_load(ip, port)
+        except (requests.RequestException, ValueError) as e:
+            remaining = max(0.0, max_wait - (time.time() - start))
+            print(f"Could not read server metrics ({e}), sleeping for the remaining {remaining:.0f} seconds...")
+            time.sleep(remaining)
+            return
+
+        idle_polls = idle_polls + 1 if running == 0 and cache_usage < 0.05 else 0
+        if idle_polls >= 2:
+            print(f"--- Server idle after {time.time() - start:.1f} seconds. ---")
+            return
+        time.sleep(poll_interval)
+
+
+def warmup_server(ip: str, port: int, model: str, num_requests: int, input_len: int):
+    """
+    Sends a few concurrent short completion requests with roughly `input_len` prompt tokens, so
+    server warm-up for a new input length (tokenizer/template setup, compilation) isn't charged to
+    the next measured run. Responses are discarded and failures are reported and ignored.
+    """
+    endpoint = f"http://{ip}:{port}/v1/completions"
+    # "hello" is a single token for common tokenizers, so this is ~input_len prompt tokens.
+    data = {"model": model, "prompt": " ".join(["hello"] * input_len), "max_tokens": 8}
+
+    def send():
+        requests.post(endpoint, json=data, timeout=300).raise_for_status()
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=num_requests) as executor:
+        futures = [executor.submit(send) for _ in range(num_requests)]
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except requests.RequestException as e:
+                print(f"Warning: Warm-up request to {endpoint} failed: {e}")
+                return
+    print(f"--- Sent {num_requests} warm-up requests (input_len={input_len}) to {ip}:{port} "
+          f"in {time.time() - start:.1f} seconds. ---")
+
+
+def run_weight(config: Dict[str, Any]) -> Tuple[int, float]:
+    """
+    Sort key for running the heaviest configs first: input_len, then concurrency (or request rate).
+    Ordering by input_len first keeps each input-length tier together, so each tier is warmed up once.
+    """
+    load = config["max_curr"] if config.get("max_curr") is not None else float(config["req_rate"])
+    return (config["input_len"], load)
+
+
+def make_result_filename(config: Dict[str, Any]) -> str:
+    """
+    Builds a unique result file name in the style of vLLM's default naming,
+    e.g. vllm-infqps-concurrency64-Qwen3-235B-A22B-20251021-203116-1a2b3c4d.json.
+    """
+    concurrency = f"-concurrency{config['max_curr']}" if config.get("max_curr") is not None else ""
+    model_id = config["model"].split("/")[-1]
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return f"vllm-{config['req_rate']}qps{concurrency}-{model_id}-{timestamp}-{uuid.uuid4().hex[:8]}.json"
+
+
+# Matches the request counter of the benchmark's tqdm progress bar, e.g. " 45%|####5     | 461/1024 [00:30<00:36, 15.40it/s]".
+PROGRESS_RE = re.compile(r"(\d+)/(\d+) \[")
+
+
+def run_streaming(command: List[str], stall_timeout_sec: float):
+    """
+    Runs the benchmark command, echoing its output live, and terminates it if it stalls:
+    no new output and no increase in the completed-request counter for `stall_timeout_sec`.
+    Raises subprocess.CalledProcessError if the command fails or is terminated.
+    """
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    last_activity = time.monotonic()
+    progress = None
+
+    def watchdog():
+        while proc.poll() is None:
+            if time.monotonic() - last_activity > stall_timeout_sec:
+                print(f"\n--- No benchmark progress for {stall_timeout_sec} seconds "
+                      f"(last progress: {progress or 'none'}), terminating it. ---")
+                proc.terminate()
+                return
+            time.sleep(1)
+
+    threading.Thread(target=watchdog, daemon=True).start()
+
+    # Output is read as it arrives rather than by line: tqdm draws each frame of its bar after a
+    # carriage return and only ends it with the next redraw, so waiting for a line ending would
+    # always echo and parse the bar one frame late.
+    pending = ""
+    while chunk := proc.stdout.read1(65536):
+        text = decoder.decode(chunk)
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        # The unterminated last segment is scanned now and again once more output completes it;
+        # the counter comparison keeps a rescanned bar from counting as progress twice.
+        segments = re.split(r"[\r\n]", pending + text)
+        pending = segments[-1]
+        for segment in segments:
+            match = PROGRESS_RE.search(segment)
+            if match is None:
+                if segment:
+                    last_activity = time.monotonic()
+            elif f"{match.group(1)}/{match.group(2)}" != progress:
+                # Redraws of the bar with an unchanged counter don't count as progress.
+                progress = f"{match.group(1)}/{match.group(2)}"
+                last_activity = time.monotonic()
+
+    returncode = proc.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+
+
+def run_in_process(command: List[str]):
+    """
+    Runs `vllm bench serve` inside this interpreter instead of a new process, saving the
+    vLLM/torch import cost per run. The same command line is parsed with vLLM's own parser.
+    There is no stall watchdog here: a run that hangs hangs the whole sweep.
+    Raises subprocess.CalledProcessError if the benchmark fails, like `run_streaming`.
+    """
+    from vllm.benchmarks.serve import add_cli_args, main as bench_serve_main
+
+    parser = argparse.ArgumentParser(prog=" ".join(command[:3]))
+    add_cli_args(parser)
     try:
-        # Read existing data if the file is not empty
-        if os.path.exists(failed_runs_file) and os.path.getsize(failed_runs_file) > 0:
-            with open(failed_runs_file, 'r') as f:
-                failed_runs = json.load(f)
-        else:
-            failed_runs = []
-        
-        # Append new failed config and write back
-        failed_runs.append(config)
-        with open(failed_runs_file, 'w') as f:
-            json.dump(failed_runs, f, indent=4)
-            
-    except (IOError, json.JSONDecodeError) as e:
-        print(f"Error writing to {failed_runs_file}: {e}")
+        bench_serve_main(parser.parse_args(command[3:]))
+    except (Exception, SystemExit) as e:
+        print(f"In-process benchmark failed: {e!r}")
+        raise subprocess.CalledProcessError(1, command) from e
+
+
+def build_command(config: Dict[str, Any], exp_setup: Dict[str, Any], raw_results_dir: str, result_filename: str) -> List[str]:
+    """Builds the `vllm bench serve` command line for a config."""
+    command = [
+        "vllm", "bench", "serve",
+        "--base-url", f"http://{exp_setup['ip']}:{exp_setup['port']}",
+        "--backend", "vllm",
+        "--model", config["model"],
+        "--endpoint", "/v1/completions",
+        "--tokenizer", config["tokenizer"],
+        "--dataset-name", "random",
+        "--random-input-len", str(config["input_len"]),
+        "--random-output-len", str(config["output_len"]),
+        "--num-prompts", str(config["num_prompts"]),
+        "--percentile-metrics", "ttft,tpot,itl,e2el",
+        "--save-result",
+        "--result-dir", raw_results_dir,
+        "--result-filename", result_filename,
+        "--request-rate", str(config["req_rate"]),
+    ]
+    # Conditionally add arguments that can be None
+    if config.get("max_curr") is not None:
+        command.extend(["--max-concurrency", str(config["max_curr"])])
+    if config.get("goodput"):
+        command.append("--goodput")
+        command.extend(config["goodput"].split())
+    return command
 
 
 def run_benchmark(config: Dict[str, Any], exp_setup: Dict[str, Any], raw_results_dir: str, failed_runs_file: str) -> Dict[str, Any]:
     """
     Runs a single benchmark using the provided config and returns the results.
     Retries on failure (completed != num_prompts).
+    The result file is written straight into `raw_results_dir` under a name chosen here.
     """
     max_retries = exp_setup.get("max_retries", 3)
     gpu_cooldown_sec = exp_setup.get("gpu_cooldown_sec", 60)
+    stall_timeout_sec = exp_setup.get("stall_timeout_sec", 300)
+    in_process = exp_setup.get("in_process", False)
+
+    # The command is the same for every attempt; a failed attempt removes its result file,
+    # so retries can reuse the file name.
+    result_filename = make_result_filename(config)
+    result_file = os.path.join(raw_results_dir, result_filename)
+    command = build_command(config, exp_setup, raw_results_dir, result_filename)
+    command_str = shlex.join(command)
 
     for attempt in range(max_retries):
         print(f"\n--- Running benchmark (Attempt {attempt + 1}/{max_retries}) for config: "
               f"num-prompts={config['num_prompts']}, max_curr={config['max_curr']}, input_len={config['input_len']}, output_len={config['output_len']} ---")
-        
-        command = [
-            "vllm", "bench", "serve",
-            "--base-url", f"http://{exp_setup['ip']}:{exp_setup['port']}",
-            "--backend", "vllm",
-            "--model", config["model"],
-            "--endpoint", "/v1/completions",
-            "--tokenizer", config["tokenizer"],
-            "--dataset-name", "random",
-            "--random-input-len", str(config["input_len"]),
-            "--random-output-len", str(config["output_len"]),
-            "--num-prompts", str(config["num_prompts"]),            
-            "--percentile-metrics", "ttft,tpot,itl,e2el",
-            "--save-result"
-        ]
-        # Conditionally add arguments that can be None or "inf"
-        command.extend(["--request-rate", str(config["req_rate"])])
-        if config.get("max_curr") is not None:
-            command.extend(["--max-concurrency", str(config["max_curr"])])
-        if config.get("goodput"):
-            command.append("--goodput")
-            command.extend(config["goodput"].split())
-
-        print(f"Executing: {' '.join(command)}")
+        print(f"Executing: {command_str}")
 
         try:
-            files_before = set(glob.glob("vllm-*.json"))
-            start_time = time.time()
-            # By removing `capture_output=True`, the subprocess output is streamed
-            # to the console, showing real-time progress from the vllm command.
-            subprocess.run(command, check=True, text=True)
-            end_time = time.time()
-            files_after = set(glob.glob("vllm-*.json"))
-
-            new_files = files_after - files_before
-            if not new_files:
-                print("Error: Benchmark ran, but no new result file (vllm-*.json) was found.")
+            start_ns = time.time_ns()
+            if in_process:
+                run_in_process(command)
+            else:
+                # The subprocess output is streamed to the console, showing real-time progress
+                # from the vllm command; a run that stops making progress is killed and retried.
+                run_streaming(command, stall_timeout_sec)
+            end_ns = time.time_ns()
+
+            if not os.path.exists(result_file):
+                print(f"Error: Benchmark ran, but the result file {result_file} was not found.")
                 continue  # Go to next retry attempt
 
-            result_file = new_files.pop()
-            print(f"--- Benchmark run took {end_time - start_time:.2f} seconds. ---")
+            print(f"--- Benchmark run took {(end_ns - start_ns) / 1e9:.2f} seconds. ---")
             print(f"--- Found result file: {result_file} ---")
             
             with open(result_file, 'r') as f:
@@ -159,11 +438,9 @@ def run_benchmark(config: Dict[str, Any], exp_setup: Dict[str, Any], raw_results
             
             if failed_requests < num_prompts // 200: # Less than 0.5% failure rate
                 print(f"--- Benchmark successful: {completed}/{num_prompts} requests completed (failure rate: {failed_requests/num_prompts:.2%}). ---")
-                # Move successful result to archive
-                os.makedirs(raw_results_dir, exist_ok=True)
-                archive_filepath = os.path.join(raw_results_dir, os.path.basename(result_file))
-                os.rename(result_file, archive_filepath)
-                print(f"--- Raw results saved to: {archive_filepath} ---")
+                print(f"--- Raw results saved to: {result_file} ---")
+                # Record when the run started as epoch nanoseconds; format it at analysis time if needed.
+                results["timestamp_ns"] = start_ns
                 return results
             else:
                 print(f"--- Benchmark failed: {completed}/{num_prompts} requests completed (failure rate: {failed_requests/num_prompts:.2%}, exceeding threshold). ---")
@@ -179,10 +456,140 @@ def run_benchmark(config: Dict[str, Any], exp_setup: Dict[str, Any], raw_results
             time.sleep(gpu_cooldown_sec)
 
     # If all retries fail
-    print(f"--- Benchmark failed after {max_retries} attempts. Logging to {failed_runs_file} ---")
+    print(f"--- Benchmark failed after {max_retries} attempts: {command_str} ---")
+    print(f"--- Logging to {failed_runs_file} ---")
     log_failed_run(config, failed_runs_file)
     return None
 
+def sweep_group_key(config: Dict[str, Any]) -> Tuple[Any, Any, Any]:
+    """Returns the (req_rate, input_len, output_len) cell a config belongs to; max_curr varies within it."""
+    return (config["req_rate"], config["input_len"], config["output_len"])
+
+
+def shard_configs(benchmark_configs: List[Dict[str, Any]], num_shards: int, adaptive: bool) -> List[List[Dict[str, Any]]]:
+    """
+    Splits the configs round-robin across servers.
+    In adaptive mode whole (req_rate, input_len, output_len) cells are kept on one server and
+    ordered by increasing max_curr, so saturation can be detected as the cell is swept.
+    """
+    if not adaptive:
+        return [benchmark_configs[i::num_shards] for i in range(num_shards)]
+
+    groups: Dict[Tuple[Any, Any, Any], List[Dict[str, Any]]] = {}
+    for config in benchmark_configs:
+        groups.setdefault(sweep_group_key(config), []).append(config)
+    ordered_groups = [sorted(group, key=lambda c: c["max_curr"] or 0) for group in groups.values()]
+    return [[c for group in ordered_groups[i::num_shards] for c in group] for i in range(num_shards)]
+
+
+def build_fieldnames(config: Dict[str, Any]) -> List[str]:
+    """
+    Returns the CSV column order: base config keys, the remaining (sweep) config keys,
+    the benchmark result fields and finally the run start timestamp.
+    """
+    other_config_keys = [k for k in config.keys() if k not in CSV_BASE_KEYS]
+    return CSV_BASE_KEYS + other_config_keys + RESULT_FIELDS + ["timestamp_ns"]
+
+
+def export_parquet(results_csv_file: str) -> None:
+    """
+    Writes a typed, zstd-compressed Parquet copy of the results CSV next to it.
+    Repeated columns (num_prompts appears as both a config key and a result field) are kept once.
+    Requires pyarrow; skipped with a warning if it isn't installed.
+    """
+    try:
+        import pyarrow.csv as pa_csv
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("Warning: pyarrow is not installed, skipping the Parquet export.")
+        return
+
+    with open(results_csv_file, 'r', newline='') as f:
+        header = next(csv.reader(f), None)
+    if not header:
+        return
+
+    # Give repeated columns unique names so they can be read, then keep the first of each.
+    column_names, keep = [], []
+    for idx, name in enumerate(header):
+        if name in header[:idx]:
+            column_names.append(f"{name}__{idx}")
+        else:
+            column_names.append(name)
+            keep.append(name)
+
+    table = pa_csv.read_csv(results_csv_file, read_options=pa_csv.ReadOptions(column_names=column_names, skip_rows=1))
+    parquet_file = os.path.splitext(results_csv_file)[0] + ".parquet"
+    pq.write_table(table.select(keep), parquet_file, compression="zstd")
+    print(f"--- Parquet copy of the results saved to: {parquet_file} ---")
+
+
+def run_sweep(benchmark_configs: List[Dict[str, Any]], exp_setup: Dict[str, Any], raw_results_dir: str,
+              failed_runs_file: str, completed_runs_file: str, save_row: Callable[[Dict[str, Any]], None],
+              sweep_params: Dict[str, Any]):
+    """
+    Runs the given configs sequentially against the server in `exp_setup`.
+    Each successful run is handed to `save_row`, which must be safe to call from several sweeps at once.
+    With `adaptive` set in the sweep params, the rest of a (req_rate, input_len, output_len) cell is
+    skipped once raising max_curr no longer increases output throughput by `adaptive_min_gain`.
+    Skipped configs are recorded as completed, so a resumed sweep doesn't run them either.
+    """
+    server = f"{exp_setup['ip']}:{exp_setup['port']}"
+    adaptive = sweep_params.get("adaptive", False)
+    min_gain = sweep_params.get("adaptive_min_gain", 0.02)
+    last_throughput: Dict[Tuple[Any, Any, Any], float] = {}
+    saturated_groups = set()
+
+    num_warmup_requests = exp_setup.get("warmup_requests", 3)
+    warmed_up_input_len = None
+
+    for i, config in enumerate(benchmark_configs):
+        group = sweep_group_key(config)
+        if adaptive and group in saturated_groups:
+            print(f"--- [{server}] Skipping run {i+1}/{len(benchmark_configs)} (max_curr={config['max_curr']}): "
+                  f"throughput already saturated for req_rate={group[0]}, input_len={group[1]}, output_len={group[2]} ---")
+            log_completed_run(config, completed_runs_file, skipped="saturated")
+            continue
+
+        # Warm up again whenever the input length changes, not just before the first run.
+        if num_warmup_requests and config["input_len"] != warmed_up_input_len:
+            warmup_server(exp_setup["ip"], exp_setup["port"], config["model"], num_warmup_requests, config["input_len"])
+            warmed_up_input_len = config["input_len"]
+
+        results = run_benchmark(config, exp_setup, raw_results_dir, failed_runs_file)
+
+        if not results:
+            print(f"--- [{server}] Skipping results for run {i+1}/{len(benchmark_configs)} due to error ---")
+            continue
+
+        # Combine the config and the benchmark results (which carry the run's timestamp_ns).
+        # Each config is a fresh dict from generate_benchmark_configs, so it's updated in place.
+        config.update(results)
+
+        save_row(config)
+
+        if adaptive and config.get("max_curr") is not None:
+            throughput = results.get("output_throughput")
+            previous = last_throughput.get(group)
+            if throughput is not None and previous is not None and throughput < previous * (1 + min_gain):
+                print(f"--- [{server}] Output throughput saturated at max_curr={config['max_curr']} "
+                      f"({previous:.1f} -> {throughput:.1f} tok/s), skipping larger max_curr for this cell ---")
+                saturated_groups.add(group)
+            if throughput is not None:
+                last_throughput[group] = throughput
+        print(f"--- [{server}] Successfully saved results for run {i+1}/{len(benchmark_configs)} ---")
+
+        # Cooldown between runs, but not after the last one
+        if i < len(benchmark_configs) - 1:
+            gpu_cooldown_sec = exp_setup.get("gpu_cooldown_sec", 60)
+            if exp_setup.get("adaptive_cooldown", True):
+                print(f"[{server}] Waiting up to {gpu_cooldown_sec} seconds for the server to go idle...")
+                wait_for_server_idle(exp_setup["ip"], exp_setup["port"], gpu_cooldown_sec)
+            else:
+                print(f"[{server}] GPU cooldown for {gpu_cooldown_sec} seconds...")
+                time.sleep(gpu_cooldown_sec)
+
+
 def main(args):
     """
     Main function to load config, loop through benchmarks, and save results.
@@ -190,7 +597,7 @@ def main(args):
     # --- Load Configuration from YAML ---
     try:
         with open(args.config_file, 'r') as f:
-            full_config = yaml.safe_load(f)
+            full_config = yaml.load(f, Loader=YamlLoader)
     except (FileNotFoundError, yaml.YAMLError) as e:
         print(f"Error loading or parsing YAML file {args.config_file}: {e}")
         sys.exit(1)
@@ -203,14 +610,28 @@ def main(args):
         print("Error: YAML file is missing one or more required top-level keys: 'experiment_setup', 'base_config', 'parameter_sweep'")
         sys.exit(1)
 
+    if exp_setup.get("in_process", False):
+        # vLLM's benchmark seeds the global random/numpy RNGs and all in-process clients would share
+        # one GIL, so concurrent in-process sweeps would race and skew client-side latencies.
+        if len(get_servers(exp_setup)) > 1:
+            print("Error: in_process can only be used with a single server; remove it or list one server.")
+            sys.exit(1)
+        try:
+            import vllm.benchmarks.serve  # noqa: F401
+        except ImportError as e:
+            print(f"Error: in_process is set but vllm's benchmark module can't be imported: {e}")
+            sys.exit(1)
+
     # --- Setup Experiment Directories and Files ---
     short_experiment_name = exp_setup.get("short_experiment_name", f"exp_{datetime.now().strftime('%Y%m%d')}")
     experiment_dir = os.path.join("experiments", short_experiment_name)
     results_csv_file = os.path.join(experiment_dir, "benchmark_results_v2.csv")
-    failed_runs_file = os.path.join(experiment_dir, "failed_runs.json")
+    failed_runs_file = os.path.join(experiment_dir, "failed_runs.jsonl")
+    completed_runs_file = os.path.join(experiment_dir, "completed_runs.jsonl")
     raw_results_dir = os.path.join(experiment_dir, "raw_results")
 
-    os.makedirs(experiment_dir, exist_ok=True)
+    # The benchmark writes its result files straight into raw_results_dir
+    os.makedirs(raw_results_dir, exist_ok=True)
 
     # --- Generate Benchmark Configurations ---
     benchmark_configs = generate_benchmark_configs(base_config, sweep_params)
@@ -220,56 +641,91 @@ def main(args):
     
     print(f"Generated {len(benchmark_configs)} benchmark configurations for experiment '{short_experiment_name}'.")
 
-    # Check if the CSV file needs a header.
-    write_header = not os.path.exists(results_csv_file) or os.path.getsize(results_csv_file) == 0
-    
-    with open(results_csv_file, 'a', newline='') as csvfile:
-        writer = None
-
-        for i, config in enumerate(benchmark_configs):
-            results = run_benchmark(config, exp_setup, raw_results_dir, failed_runs_file)
-            
-            if not results:
-                print(f"--- Skipping results for run {i+1}/{len(benchmark_configs)} due to error ---")
-                continue
-
-            # Combine the config and the benchmark results
-            combined_data = config.copy()
-            combined_data.update(results)
-            
-            # Add a timestamp for uniqueness
-            combined_data["timestamp"] = datetime.now().isoformat()
-
-            # On the first successful run, setup the CSV writer and write the header
-            if writer is None:
-                # Define column order for better readability in the CSV.
-                # Start with base config keys in a sensible order.
-                base_keys = [
-                    "model", "tokenizer", "hardware", "notes", "pd_enabled",
-                    "prefill_node", "prefill_dp", "prefill_tp",
-                    "decode_node", "decode_dp", "decode_tp"
-                ]
-                # Add sweep parameters and other config keys that are not in base_keys.
-                other_config_keys = [k for k in config.keys() if k not in base_keys]
-                result_keys = list(results.keys())
-
-                fieldnames = base_keys + other_config_keys + result_keys + ["timestamp"]
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                if write_header:
-                    writer.writeheader()
-                    write_header = False # Prevent writing header again in this session
-            
-            # Ensure all fields are present for this row
-            row_to_write = {field: combined_data.get(field) for field in writer.fieldnames}
-            writer.writerow(row_to_write)
-            csvfile.flush() # Save progress immediately
-            print(f"--- Successfully saved results for run {i+1}/{len(benchmark_configs)} ---")
-            
-            # Cooldown between runs, but not after the last one
-            if i < len(benchmark_configs) - 1:
-                gpu_cooldown_sec = exp_setup.get("gpu_cooldown_sec", 60)
-                print(f"GPU cooldown for {gpu_cooldown_sec} seconds...")
-                time.sleep(gpu_cooldown_sec)
+    # --- Skip configs already completed by a previous (interrupted) invocation ---
+    if not args.force:
+        done = {resume_key(record) for record in load_jsonl(completed_runs_file)}
+        remaining_configs = [config for config in benchmark_configs if resume_key(config) not in done]
+        if len(remaining_configs) < len(benchmark_configs):
+            print(f"Resuming: {len(benchmark_configs) - len(remaining_configs)} configurations already completed "
+                  f"(see {completed_runs_file}; use --force to rerun them).")
+        benchmark_configs = remaining_configs
+        if not benchmark_configs:
+            print("All benchmark configurations have already been completed.")
+            sys.exit(0)
+
+    # Run the heaviest configs first so an unstable server fails early rather than hours in.
+    # Adaptive sweeps need increasing max_curr within each cell, so they keep their order.
+    if exp_setup.get("heaviest_first", True) and not sweep_params.get("adaptive", False):
+        benchmark_configs.sort(key=run_weight, reverse=True)
+
+    # --- Spread the sweep across servers ---
+    # Each server gets its own slice of the configs (round-robin) and runs it sequentially,
+    # so a server never sees more than one benchmark at a time. The runs themselves are
+    # subprocesses, so one driver thread per server is enough to keep them all busy.
+    servers = get_servers(exp_setup)
+    shards = shard_configs(benchmark_configs, len(servers), sweep_params.get("adaptive", False))
+    if len(servers) > 1:
+        print(f"Spreading the sweep across {len(servers)} servers: {', '.join(f'{ip}:{port}' for ip, port in servers)}")
+
+    # All generated configs share the same keys, so the column set is known before any run.
+    fieldnames = build_fieldnames(benchmark_configs[0])
+    # Fields already accounted for, so save_row only warns about genuinely new result fields.
+    known_fields = set(fieldnames)
+    legacy_timestamp = False
+
+    # 'a+' creates the file if needed and lets us read an existing header from the same handle;
+    # writes always go to the end of the file.
+    with open(results_csv_file, 'a+', newline='') as csvfile:
+        csvfile.seek(0)
+        existing_fieldnames = next(csv.reader(csvfile), None)
+        csvfile.seek(0, os.SEEK_END)
+
+        writer = csv.writer(csvfile)
+        if existing_fieldnames is None:
+            # New or empty file
+            writer.writerow(fieldnames)
+            csvfile.flush()
+        elif existing_fieldnames != fieldnames:
+            # Keep the existing columns so new rows line up with the header.
+            # Files from before timestamp_ns have an ISO `timestamp` column instead, which is still filled in.
+            legacy_timestamp = "timestamp" in existing_fieldnames and "timestamp_ns" not in existing_fieldnames
+            missing = [k for k in fieldnames if k not in existing_fieldnames
+                       and not (legacy_timestamp and k == "timestamp_ns")]
+            if missing:
+                print(f"Warning: Appending to {results_csv_file} with its existing columns. "
+                      f"Columns not in its header will be dropped: {missing}")
+            fieldnames = existing_fieldnames
+            known_fields.update(fieldnames)
+        csv_lock = threading.Lock()
+
+        def save_row(combined_data: Dict[str, Any]):
+            if legacy_timestamp and combined_data.get("timestamp_ns") is not None:
+                combined_data["timestamp"] = datetime.fromtimestamp(combined_data["timestamp_ns"] / 1e9).isoformat()
+            row = [combined_data.get(field) for field in fieldnames]
+            with csv_lock:
+                unknown_fields = [k for k in combined_data if k not in known_fields]
+                if unknown_fields:
+                    # Most likely a newer vLLM reporting extra metrics; they're kept in the raw results.
+                    print(f"Warning: Result fields not in the CSV columns (see raw results): {unknown_fields}")
+                    known_fields.update(unknown_fields)
+                writer.writerow(row)
+                csvfile.flush() # Save progress immediately; each row is minutes of GPU time
+            # Record the run only once its row is saved, so a resumed sweep never loses a result.
+            log_completed_run(combined_data, completed_runs_file)
+
+        with ThreadPoolExecutor(max_workers=len(servers)) as executor:
+            futures = []
+            for shard, (ip, port) in zip(shards, servers):
+                server_setup = {**exp_setup, "ip": ip, "port": port}
+                futures.append(executor.submit(
+                    run_sweep, shard, server_setup, raw_results_dir, failed_runs_file, completed_runs_file, save_row, sweep_params
+                ))
+
+            for future in as_completed(futures):
+                future.result()
+
+    if exp_setup.get("export_parquet", False):
+        export_parquet(results_csv_file)
 
 
 if __name__ == "__main__":
@@ -279,5 +735,10 @@ if __name__ == "__main__":
         type=str,
         help="Path to the YAML configuration file for the experiment."
     )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rerun configurations already recorded as completed for this experiment."
+    )
     args = parser.parse_args()
     main(args)
@@ -1,17 +1,34 @@
-import requests
+import aiohttp
+import asyncio
 import datetime
-import random
+import functools
+import gzip
+import itertools
+import os
+import time
 import argparse
 import json
+import sys
+import numpy as np
+import orjson
+
+try:
+    import uvloop  # Optional: a faster event loop for high --concurrency
+except ImportError:
+    uvloop = None
 
 # example command
 # python run_single_request.py --endpoint ${ENDPOINT}/v1/completions --model Qwen/Qwen3-235B-A22B --num-words 30000 --max-tokens 2000 &
 # 
 
-# Simple concurrency
-# CMD_TO_RUN="python run_single_request.py --endpoint ${ENDPOINT}/v1/completions --model Qwen/Qwen3-235B-A22B --num-words 5000 --max-tokens 250"
-# PARALLEL_JOBS=512
-# seq 1 512 | xargs -P ${PARALLEL_JOBS} -n 1 sh -c "${CMD_TO_RUN}"
+# Simple concurrency: 512 concurrent requests from a single process
+# python run_single_request.py --endpoint ${ENDPOINT}/v1/completions --model Qwen/Qwen3-235B-A22B --num-words 5000 --max-tokens 250 --concurrency 512
+
+# 2048 requests in total, with at most 256 in flight at a time
+# python run_single_request.py --endpoint ${ENDPOINT}/v1/completions --model Qwen/Qwen3-235B-A22B --num-words 5000 --max-tokens 250 --concurrency 256 --total 2048
+
+# 512 concurrent requests sharing one prompt (exercises the server's prefix cache)
+# python run_single_request.py --endpoint ${ENDPOINT}/v1/completions --model Qwen/Qwen3-235B-A22B --num-words 5000 --max-tokens 250 --concurrency 512 --shared-prompt
 
 SAMPLE_WORDS = [
     "the", "be", "to", "of", "and", "a", "in", "that", "have", "I", "it", "for",
@@ -26,75 +43,267 @@ SAMPLE_WORDS = [
     "even", "new", "want", "because", "any", "these", "give", "day", "most", "us"
 ]
 
+JSON_HEADERS = {"Content-Type": "application/json"}
+GZIP_JSON_HEADERS = {**JSON_HEADERS, "Content-Encoding": "gzip"}
+
+# Word table and RNG for generate_prompt, so words are sampled in one vectorized call
+_WORDS_NP = np.array(SAMPLE_WORDS, dtype=object)
+_RNG = np.random.default_rng()
+
 def generate_prompt(num_words):
     """Generates a prompt string with a specified number of random words."""
-    print(f"Generating a prompt with {num_words} random words...")
-    prompt_words = random.choices(SAMPLE_WORDS, k=num_words)
-    return " ".join(prompt_words)
+    idx = _RNG.integers(0, len(SAMPLE_WORDS), size=num_words)
+    return " ".join(_WORDS_NP[idx].tolist())
 
-def send_request(endpoint, model, prompt, max_tokens):
-    """Sends the completion request and prints timing information."""
-    
-    headers = {
-        "Content-Type": "application/json"
-    }
-    
+def iter_cached_prompts(path, num_prompts, num_words):
+    """
+    Returns an iterator over `num_prompts` prompts of `num_words` words from a cache file with one prompt per line,
+    first generating and saving more if the file is missing, too short or holds prompts of another length.
+    Prompts are read one at a time as they're needed, so they're never all held in memory.
+    """
+    usable = 0
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            for line in f:
+                if usable == 0 and line.rstrip("\n").count(" ") + 1 != num_words:
+                    print(f"Prompt cache {path} holds prompts of a different length, regenerating it...")
+                    break
+                usable += 1
+                if usable == num_prompts:
+                    break
+
+    if usable < num_prompts:
+        print(f"Generating {num_prompts - usable} prompt(s) with {num_words} random words into {path}...")
+        with open(path, "r+" if usable else "w") as f:
+            # Keep the usable prompts and write the new ones after them, dropping anything else
+            line = ""
+            for _ in range(usable):
+                line = f.readline()
+            f.seek(f.tell())
+            f.truncate()
+            if line and not line.endswith("\n"):
+                f.write("\n")
+            for _ in range(num_prompts - usable):
+                f.write(generate_prompt(num_words) + "\n")
+
+    def read_prompts():
+        with open(path, "r") as f:
+            for line, _ in zip(f, range(num_prompts)):
+                yield line.rstrip("\n")
+    return read_prompts()
+
+def load_tokenizer(tokenizer_name):
+    """
+    Loads the model's Hugging Face tokenizer, so requests can send token IDs,
+    which are smaller on the wire and skip tokenization on the server.
+    """
+    from transformers import AutoTokenizer  # only needed with --use-token-ids
+    print(f"Loading the {tokenizer_name} tokenizer...")
+    return AutoTokenizer.from_pretrained(tokenizer_name)
+
+def describe_prompt(prompt):
+    """Returns the prompt size for the request log, in words for text prompts or tokens for token ID prompts."""
+    is_batch = isinstance(prompt, tuple) and len(prompt) > 0 and not isinstance(prompt[0], int)
+    first = prompt[0] if is_batch else prompt
+    if isinstance(first, tuple):
+        size = f"Prompt Tokens: {len(first)}"
+    else:
+        size = f"Prompt Words: {first.count(' ') + 1 if first else 0}"
+    return f"Prompts: {len(prompt)}, {size} each" if is_batch else size
+
+async def read_sse_stream(response, start_ns):
+    """
+    Reads a streamed (SSE) completion response line by line as it arrives.
+    Returns the reassembled response (one choice per prompt, plus usage) and the time to first token.
+    """
+    texts = {}
+    usage = None
+    ttft = None
+    async for line in response.content:
+        if not line.startswith(b"data:"):
+            continue  # blank separator lines between events
+        payload = line[5:].strip()
+        if payload == b"[DONE]":
+            break
+        chunk = orjson.loads(payload)
+        for choice in chunk.get("choices", []):
+            if ttft is None and choice.get("text"):
+                ttft = (time.perf_counter_ns() - start_ns) / 1e9
+            texts[choice["index"]] = texts.get(choice["index"], "") + choice.get("text", "")
+        if chunk.get("usage"):
+            usage = chunk["usage"]
+
+    response_data = {"choices": [{"index": i, "text": texts[i]} for i in sorted(texts)]}
+    if usage:
+        response_data["usage"] = usage
+    return response_data, ttft
+
+@functools.lru_cache(maxsize=8)
+def build_body(model, prompt, max_tokens, stream=False, gzip_body=False):
+    """
+    Serializes the completion request body. The few most recent bodies are cached, which is enough
+    for --shared-prompt to serialize once without keeping every distinct body alive.
+    `prompt` may be a single string or a tuple of strings, which the server completes as one batch,
+    or the token IDs of one or more prompts (as tuples, so they can be cached on).
+    With `gzip_body`, the body is gzip-compressed.
+    """
     data = {
         "model": model,
         "max_tokens": max_tokens,
         "prompt": prompt,
-        "stream": False # Explicitly disable streaming for a single response
+        "stream": stream
     }
+    if stream:
+        # Ask for a final chunk with token counts, which a non-streamed response always has
+        data["stream_options"] = {"include_usage": True}
+
+    # orjson serializes large prompts much faster than the stdlib json aiohttp would use
+    body = orjson.dumps(data)
+    if gzip_body:
+        # Level 1: the random-word prompts compress well even at the cheapest level
+        body = gzip.compress(body, compresslevel=1)
+    return body
+
+def write_lines(lines):
+    """Writes a block of log lines to stdout in a single write (and at most one flush) rather than one per line."""
+    sys.stdout.write("\n".join(lines) + "\n")
 
-    print(f"==================================================")
-    print(f"Preparing request at: {datetime.datetime.now().isoformat()}")
-    print(f"Target Endpoint: {endpoint}")
-    print(f"Model: {model}, Prompt Words: {len(prompt.split())}, Max Tokens: {max_tokens}")
-    print(f"==================================================")
+async def send_request(session, endpoint, body, headers, model, prompt, max_tokens, request_id=0, stream=False,
+                       verbose=False):
+    """
+    Sends the pre-serialized completion request `body` and prints timing information.
+    `model`, `prompt` and `max_tokens` are only used for the log.
+    With `stream`, the completion is streamed back and the time to first token is reported too.
+    With `verbose`, the whole response is logged as indented JSON, rather than just the start
+    of each completion and the token usage.
+    """
+    write_lines([
+        f"==================================================",
+        f"[Request {request_id}] Preparing request at: {datetime.datetime.now().isoformat()}",
+        f"Target Endpoint: {endpoint}",
+        f"Model: {model}, {describe_prompt(prompt)}, Max Tokens: {max_tokens}",
+        f"==================================================",
+    ])
 
     try:
-        # The time measurement for the request itself starts inside `requests.post`
-        response = requests.post(endpoint, headers=headers, data=json.dumps(data), timeout=300) # 5 min timeout
-        
-        # Record end time as soon as the call returns
+        start_time = datetime.datetime.now()
+        start_ns = time.perf_counter_ns()
+        response_data = None
+        ttft = None
+        async with session.post(endpoint, data=body, headers=headers,
+                                timeout=aiohttp.ClientTimeout(total=300)) as response: # 5 min timeout
+            if stream and response.status == 200:
+                response_data, ttft = await read_sse_stream(response, start_ns)
+            else:
+                response_body = await response.read()
+
+        # Record end time as soon as the full response has been read.
+        # Durations come from the monotonic perf counter; the datetimes are only for the log.
+        duration = (time.perf_counter_ns() - start_ns) / 1e9
         end_time = datetime.datetime.now()
-        
-        # `response.elapsed` is a timedelta of time between sending the request
-        # and the arrival of the response's headers. This is more accurate.
-        duration_td = response.elapsed
-        start_time = end_time - duration_td
-
-        print(f"\n==================================================")
-        print(f"Request Start: {start_time.isoformat()}")
-        print(f"Request End:   {end_time.isoformat()}")
-        print(f"Total Duration (from requests lib): {duration_td.total_seconds():.6f} seconds")
-        print(f"==================================================")
-
-        if response.status_code == 200:
-            print("\nResponse JSON (truncated):")
+
+        lines = [
+            f"\n==================================================",
+            f"[Request {request_id}]",
+            f"Request Start: {start_time.isoformat()}",
+            f"Request End:   {end_time.isoformat()}",
+        ]
+        if ttft is not None:
+            lines.append(f"Time To First Token: {ttft:.6f} seconds")
+        lines += [
+            f"Total Duration: {duration:.6f} seconds",
+            f"==================================================",
+        ]
+
+        if response.status == 200:
             try:
-                response_data = response.json()
-                # Truncate the choice text for clean logging
-                if "choices" in response_data and len(response_data["choices"]) > 0:
-                    response_data["choices"][0]["text"] = response_data["choices"][0]["text"][:80] + "..."
-                print(json.dumps(response_data, indent=2))
+                if response_data is None:
+                    response_data = orjson.loads(response_body)
+                if verbose:
+                    lines.append("\nResponse JSON (truncated):")
+                    # Truncate the choice texts for clean logging (one choice per prompt in a batch)
+                    for choice in response_data.get("choices", []):
+                        choice["text"] = choice["text"][:80] + "..."
+                    lines.append(json.dumps(response_data, indent=2))
+                else:
+                    lines.append("\nResponse (truncated):")
+                    for choice in response_data.get("choices", []):
+                        lines.append(f"Choice {choice.get('index', 0)}: text[:80]={choice['text'][:80]!r}")
+                    lines.append(f"Usage: {response_data.get('usage')}")
             except json.JSONDecodeError:
-                print("Could not decode JSON response. Raw text:")
-                print(response.text[:200] + "...")
+                lines.append("\nCould not decode JSON response. Raw text:")
+                lines.append(response_body[:200].decode(errors="replace") + "...")
         else:
-            print(f"\nError: Received Status Code {response.status_code}")
-            print("Response Text:")
-            print(response.text)
-
-    except requests.exceptions.ConnectionError as e:
-        print(f"\nRequest Failed: Connection Error. Is the server running at {endpoint}?")
-        print(f"Error details: {e}")
-    except requests.exceptions.ReadTimeout as e:
-        print(f"\nRequest Failed: Read Timeout.")
-        print(f"Error details: {e}")
+            lines += [
+                f"\nError: Received Status Code {response.status}",
+                "Response Text:",
+                response_body.decode(errors="replace"),
+            ]
+        write_lines(lines)
+
+    except aiohttp.ClientConnectionError as e:
+        write_lines([
+            f"\n[Request {request_id}] Request Failed: Connection Error. Is the server running at {endpoint}?",
+            f"Error details: {e}",
+        ])
+    except asyncio.TimeoutError as e:
+        write_lines([
+            f"\n[Request {request_id}] Request Failed: Timeout.",
+            f"Error details: {e}",
+        ])
     except Exception as e:
         end_time = datetime.datetime.now()
-        print(f"\nAn unexpected error occurred at {end_time.isoformat()}: {e}")
+        write_lines([f"\n[Request {request_id}] An unexpected error occurred at {end_time.isoformat()}: {e}"])
+
+async def run_all(args, request_prompts):
+    """
+    Sends one request per prompt (or prompt batch) from `request_prompts` over one persistent HTTP session,
+    using --concurrency workers that each send one request at a time.
+    """
+    # No connection cap (the number of in-flight requests is the cap) and long-lived
+    # keep-alive, so a finished request's connection is reused instead of reopened.
+    # vLLM's API server runs on uvicorn, which only speaks HTTP/1.1, so concurrent requests
+    # need one connection each; HTTP/2 multiplexing isn't available to a client here.
+    # Nagle's algorithm is already off: asyncio and uvloop set TCP_NODELAY on every TCP
+    # transport they create. SO_REUSEPORT only affects listening sockets, so it isn't set.
+    connector = aiohttp.TCPConnector(limit=0, keepalive_timeout=75, ttl_dns_cache=300)
+    headers = GZIP_JSON_HEADERS if args.gzip_body else JSON_HEADERS
+    numbered_prompts = enumerate(request_prompts)
+
+    def next_request():
+        """Generates the next prompt and serializes its body; returns None once all requests are built."""
+        for request_id, prompt in numbered_prompts:
+            # build_body is cached: with --shared-prompt all requests send the same bytes.
+            return request_id, prompt, build_body(args.model, prompt, args.max_tokens, args.stream, args.gzip_body)
+        return None
+
+    # At most --concurrency built requests wait in the queue, so memory scales with --concurrency,
+    # not --total. The first --concurrency are built before anything is sent; the rest are built in
+    # a thread, so that work doesn't stall the event loop while in-flight requests read their responses.
+    queue = asyncio.Queue(maxsize=args.concurrency)
+    for _ in range(args.concurrency):
+        request = next_request()
+        if request is None:
+            break
+        queue.put_nowait(request)
+
+    async def produce():
+        try:
+            while (request := await asyncio.to_thread(next_request)) is not None:
+                await queue.put(request)
+        finally:
+            # One end marker per worker, also if building a request failed
+            for _ in range(args.concurrency):
+                await queue.put(None)
+
+    async def worker(session):
+        while (request := await queue.get()) is not None:
+            request_id, prompt, body = request
+            await send_request(session, args.endpoint, body, headers, args.model, prompt,
+                               args.max_tokens, request_id, args.stream, args.verbose)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(produce(), *[worker(session) for _ in range(args.concurrency)])
 
 def main():
     parser = argparse.ArgumentParser(description="vLLM load testing script.")
@@ -122,11 +331,103 @@ def main():
         default="Qwen/Qwen3-235B-A22B",
         help="The model name to send in the request."
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Maximum number of requests in flight at once."
+    )
+    parser.add_argument(
+        "--total",
+        type=int,
+        default=None,
+        help="Total number of requests to send, each with its own random prompt unless --shared-prompt is set. "
+             "Defaults to --concurrency, i.e. all requests are sent at once."
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="Number of prompts to send in each request, as a list in the `prompt` field."
+    )
+    parser.add_argument(
+        "--prompt-cache",
+        type=str,
+        default=None,
+        help="File to read pre-generated prompts from (one per line), created on first use. "
+             "Note that reused prompts may hit the server's prefix cache from earlier runs."
+    )
+    parser.add_argument(
+        "--shared-prompt",
+        action="store_true",
+        help="Generate a single prompt and send it in every request instead of one per request. "
+             "All but the first prefill will then likely be prefix cache hits on the server."
+    )
+    parser.add_argument(
+        "--use-token-ids",
+        action="store_true",
+        help="Tokenize each prompt before it's sent (requires `transformers`) and send token IDs "
+             "instead of text, which the server then doesn't need to tokenize."
+    )
+    parser.add_argument(
+        "--tokenizer",
+        type=str,
+        default=None,
+        help="Hugging Face tokenizer to use with --use-token-ids. Defaults to --model."
+    )
+    parser.add_argument(
+        "--gzip-body",
+        action="store_true",
+        help="Gzip the request body and send it with `Content-Encoding: gzip`. vLLM's API server doesn't "
+             "decompress request bodies itself, so this needs a proxy or gateway in front that does."
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream the completion back and report the time to first token."
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Log each full response as indented JSON instead of only the start of each completion and the token usage."
+    )
     
     args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.total is not None and args.total < 1:
+        parser.error("--total must be at least 1")
 
-    prompt = generate_prompt(args.num_words)
-    send_request(args.endpoint, args.model, prompt, args.max_tokens)
+    # A separate prompt per request, like separate processes would send, so prefix caching
+    # on the server doesn't turn all but the first prefill into a cache hit.
+    # With --shared-prompt, only one prompt is generated and every request references it.
+    # Prompts are produced lazily, as run_all builds the requests.
+    num_requests = args.total or args.concurrency
+    num_prompts = num_requests * args.batch_size
+    num_distinct = 1 if args.shared_prompt else num_prompts
+    if args.prompt_cache:
+        prompts = iter_cached_prompts(args.prompt_cache, num_distinct, args.num_words)
+    else:
+        print(f"Generating {num_distinct} prompt(s) with {args.num_words} random words as they're sent...")
+        prompts = (generate_prompt(args.num_words) for _ in range(num_distinct))
+    if args.use_token_ids:
+        tokenizer = load_tokenizer(args.tokenizer or args.model)
+        prompts = (tuple(tokenizer(prompt).input_ids) for prompt in prompts)
+    if args.shared_prompt:
+        # Every request references the same prompt (or batch of copies of it)
+        prompt = next(prompts)
+        shared = prompt if args.batch_size == 1 else (prompt,) * args.batch_size
+        request_prompts = itertools.repeat(shared, num_requests)
+    elif args.batch_size > 1:
+        request_prompts = (tuple(itertools.islice(prompts, args.batch_size)) for _ in range(num_requests))
+    else:
+        request_prompts = prompts
+    run = getattr(uvloop, "run", None)
+    if run is None:
+        if uvloop is not None:
+            uvloop.install()  # uvloop < 0.18 has no uvloop.run
+        run = asyncio.run
+    run(run_all(args, request_prompts))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file